@@ -0,0 +1,386 @@
+"""
+Benchmarks of the (computationally) heavy steps in the course notebooks.
+
+Each benchmark reproduces an operation of the exercise solutions on the data
+in `notebooks/data`, optionally scaled up with synthetic copies of the input
+(e.g. `--scale 1 10 100`) to see how the run time grows with the data size.
+For each benchmark, the wall time (best of `--repeat` runs), the throughput and
+the peak memory (RSS) of the process are reported. The peak memory is reported
+both after the setup (reading the input data) and as the increase during the
+benchmarked step itself. As the peak can only grow, the latter is 0 if the step
+stays below the peak reached during the setup.
+
+Usage:
+
+    python benchmarks.py                         # run all benchmarks
+    python benchmarks.py sjoin overlay           # run a selection
+    python benchmarks.py --scale 1 10 100        # scaled-up inputs
+    python benchmarks.py --save baseline.json    # store the results
+    python benchmarks.py --compare baseline.json # check for regressions
+
+When comparing against a stored baseline, the script exits with a non-zero
+exit code if a benchmark became slower, or its peak memory increase larger,
+than `--threshold` times the baseline.
+"""
+import argparse
+import json
+import math
+import multiprocessing
+import sys
+import time
+from pathlib import Path
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+
+DATA_DIR = Path(__file__).resolve().parent / "notebooks" / "data"
+
+BENCHMARKS = {}
+
+# differences in the peak memory increase below this size (MB) are not flagged as regression
+MEMORY_TOLERANCE_MB = 10
+
+
+def benchmark(name, unit):
+    """Register a benchmark
+
+    The decorated function gets the scale factor and returns the function to
+    time (without arguments) and the number of processed items (in `unit`).
+    """
+    def decorator(setup):
+        BENCHMARKS[name] = (setup, unit)
+        return setup
+    return decorator
+
+
+def repeat_rows(df, scale):
+    """Synthetic scaled-up input by repeating the rows of a (Geo)DataFrame"""
+    import pandas as pd
+    return pd.concat([df] * scale, ignore_index=True)
+
+
+def upsample_factor(scale):
+    """Factor for each of the 2 raster dimensions to get `scale` times the pixels"""
+    return max(1, round(math.sqrt(scale)))
+
+
+def load_dem_gent(scale=1):
+    """DEM subset of 10 km around Gent (as in 13-raster-processing), optionally at a finer resolution"""
+    import geopandas
+    import xarray as xr
+    import rioxarray
+    from shapely.geometry import Point
+
+    dem = xr.open_dataarray(f"zip://{DATA_DIR}/gent/DHMVIIDTMRAS25m.zip", engine="rasterio").sel(band=1)
+    gent_centre = geopandas.GeoSeries([Point(3.72174, 51.05393)], crs="EPSG:4326").to_crs("EPSG:31370")
+    dem_gent = dem.rio.clip_box(*gent_centre.buffer(10 * 1000).total_bounds)
+    factor = upsample_factor(scale)
+    if factor > 1:
+        ny, nx = dem_gent.shape
+        dem_gent = dem_gent.rio.reproject(dem_gent.rio.crs, shape=(ny * factor, nx * factor))
+    return dem_gent
+
+
+def load_cn_points(crs):
+    """The CurieuzeNeuzen measurement locations (case-curieuzeneuzen-air-quality)"""
+    import pandas as pd
+    import geopandas
+
+    df = pd.read_csv(DATA_DIR / "CN_Flanders_open_dataset.csv")
+    gdf = geopandas.GeoDataFrame(
+        df, geometry=geopandas.points_from_xy(df["lon"], df["lat"]), crs="EPSG:4326")
+    return gdf.to_crs(crs)
+
+
+@benchmark("sjoin", unit="trees")
+def setup_sjoin(scale):
+    import geopandas
+
+    districts = geopandas.read_file(DATA_DIR / "paris_districts.geojson").to_crs(epsg=2154)
+    trees = repeat_rows(geopandas.read_file(DATA_DIR / "paris_trees.gpkg"), scale).to_crs(epsg=2154)
+
+    def run():
+        geopandas.sjoin(trees, districts, predicate="within")
+
+    return run, len(trees)
+
+
+@benchmark("overlay", unit="polygons")
+def setup_overlay(scale):
+    import geopandas
+
+    districts = geopandas.read_file(DATA_DIR / "paris_districts.geojson").to_crs(epsg=2154)
+    land_use = geopandas.read_file(f"zip://{DATA_DIR}/paris_land_use.zip").to_crs(epsg=2154)
+    land_use = repeat_rows(land_use, scale)
+
+    def run():
+        geopandas.overlay(land_use, districts, how="intersection", keep_geom_type=True)
+
+    return run, len(land_use)
+
+
+def load_gent_roads_points(scale):
+    """Road segments of Gent (13-raster-processing) and the CurieuzeNeuzen locations within their extent"""
+    import geopandas
+
+    roads = geopandas.read_file(f"zip://{DATA_DIR}/gent/vector/wegsegmenten-gent.geojson.zip").to_crs("EPSG:31370")
+    points = load_cn_points("EPSG:31370")
+    points = repeat_rows(points.cx[slice(*roads.total_bounds[[0, 2]]), slice(*roads.total_bounds[[1, 3]])], scale)
+    return roads, points
+
+
+@benchmark("closest_road_type", unit="points")
+def setup_closest_road_type(scale):
+    # the approach of the solution of case-curieuzeneuzen-air-quality: the distance
+    # to each of the dissolved road types, for each point separately
+    roads, points = load_gent_roads_points(scale)
+    roads_unioned = roads.dissolve("frc_omschrijving").reset_index()
+
+    def closest_road_type(point, streets):
+        dist = streets.distance(point)
+        idx_closest = dist.idxmin()
+        return streets.loc[idx_closest, "frc_omschrijving"]
+
+    def run():
+        points.geometry.apply(lambda point: closest_road_type(point, roads_unioned))
+
+    return run, len(points)
+
+
+@benchmark("nearest_road", unit="points")
+def setup_nearest_road(scale):
+    import geopandas
+
+    # the spatial index based alternative of the closest_road_type benchmark
+    roads, points = load_gent_roads_points(scale)
+
+    def run():
+        geopandas.sjoin_nearest(points[["geometry"]], roads[["frc_omschrijving", "geometry"]],
+                                how="left", distance_col="distance")
+
+    return run, len(points)
+
+
+@benchmark("point_query", unit="points")
+def setup_point_query(scale):
+    import rasterstats
+
+    raster_file = DATA_DIR / "CLC2018_V2020_20u1_flanders.tif"
+    points = repeat_rows(load_cn_points("EPSG:3035"), scale)
+
+    def run():
+        rasterstats.point_query(points.geometry, raster_file, interpolate="nearest")
+
+    return run, len(points)
+
+
+@benchmark("reproject_match", unit="pixels")
+def setup_reproject_match(scale):
+    import xarray as xr
+    import rioxarray
+
+    dem_gent = load_dem_gent(scale)
+    land_use = xr.open_dataarray(DATA_DIR / "CLC2018_V2020_20u1_flanders.tif", engine="rasterio").sel(band=1)
+
+    def run():
+        land_use.rio.reproject_match(dem_gent)
+
+    return run, dem_gent.size
+
+
+@benchmark("rasterize", unit="pixels")
+def setup_rasterize(scale):
+    import geopandas
+    import rasterio.features
+
+    dem_gent = load_dem_gent(scale)
+    roads = geopandas.read_file(f"zip://{DATA_DIR}/gent/vector/wegsegmenten-gent.geojson.zip").to_crs("EPSG:31370")
+    roads_buffer = roads.buffer(25)
+
+    def run():
+        rasterio.features.rasterize(
+            roads_buffer, out_shape=dem_gent.shape, transform=dem_gent.rio.transform())
+
+    return run, dem_gent.size
+
+
+@benchmark("focal_stats", unit="pixels")
+def setup_focal_stats(scale):
+    import numpy as np
+    import geopandas
+    import rasterio.features
+    import xarray as xr
+    from xrspatial import focal, convolution
+
+    dem_gent = load_dem_gent()
+    green = geopandas.read_file(DATA_DIR / "gent/vector/parken-gent.geojson").to_crs("EPSG:31370")
+    green_arr = rasterio.features.rasterize(
+        green.geometry.dropna(), out_shape=dem_gent.shape, transform=dem_gent.rio.transform())
+    # tile the array (and not the resolution) to keep the kernel size constant
+    factor = upsample_factor(scale)
+    green_arr = xr.DataArray(np.tile(green_arr, (factor, factor)), dims=("y", "x"))
+    green_arr = green_arr.assign_coords(
+        x=dem_gent.x[0].item() + 25 * np.arange(green_arr.sizes["x"]),
+        y=dem_gent.y[0].item() - 25 * np.arange(green_arr.sizes["y"]))
+    kernel = convolution.circle_kernel(25, 25, 500)
+
+    def run():
+        focal.focal_stats(green_arr, kernel, stats_funcs=["sum"])
+
+    return run, green_arr.size
+
+
+def load_era5(scale):
+    """ERA5 example data, scaled up by repeating the data along the longitude"""
+    import numpy as np
+    import xarray as xr
+
+    era5 = xr.open_dataset(DATA_DIR / "era5-land-monthly-means_example.nc").load()
+    if scale > 1:
+        era5 = xr.concat([era5] * scale, dim="longitude")
+        era5 = era5.assign_coords(longitude=np.arange(era5.sizes["longitude"]) * 0.1)
+    return era5
+
+
+@benchmark("era5_groupby", unit="values")
+def setup_era5_groupby(scale):
+    era5 = load_era5(scale)
+
+    def run():
+        era5.groupby("time.season").mean()
+        gb = era5.groupby("time.month")
+        (gb - gb.mean()).compute()
+
+    return run, era5["t2m"].size * len(era5.data_vars)
+
+
+@benchmark("era5_resample", unit="values")
+def setup_era5_resample(scale):
+    era5 = load_era5(scale)
+
+    def run():
+        era5.resample(time="YE").mean()
+        era5.resample(time="YE").sum()
+
+    return run, era5["t2m"].size * len(era5.data_vars)
+
+
+@benchmark("sst_groupby", unit="values")
+def setup_sst_groupby(scale):
+    import xarray as xr
+
+    data_file = DATA_DIR / "sst.mnmean.v4.nc"
+    if not data_file.exists():
+        raise FileNotFoundError(f"{data_file.name} is not available, see case-sea-surface-temperature.ipynb")
+    ds = xr.open_dataset(data_file, drop_variables=["time_bnds"])
+    sst = xr.concat([ds["sst"].sel(time=slice("1960", "2018")).load()] * scale, dim="lon")
+
+    def run():
+        gb = sst.groupby("time.month")
+        gb - gb.mean(dim="time")
+
+    return run, sst.size
+
+
+def peak_rss_mb():
+    """Peak resident set size (memory) of the current process in MB"""
+    if resource is None:
+        return float("nan")
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / 1024**2 if sys.platform == "darwin" else peak / 1024
+
+
+def run_benchmark(name, scale, repeat):
+    """Set up and time a single benchmark (run in a separate process to measure its memory)"""
+    setup, unit = BENCHMARKS[name]
+    try:
+        run, n_items = setup(scale)
+    except FileNotFoundError as err:
+        return {"skipped": str(err)}
+    peak_setup = peak_rss_mb()
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        timings.append(time.perf_counter() - start)
+    best = min(timings)
+    return {
+        "time": best,
+        "peak_rss_setup_mb": peak_setup,
+        "peak_rss_increase_mb": peak_rss_mb() - peak_setup,
+        "throughput": n_items / best,
+        "unit": unit,
+        "n": n_items,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("names", nargs="*", metavar="NAME",
+                        help=f"benchmarks to run (default: all): {', '.join(BENCHMARKS)}")
+    parser.add_argument("--scale", nargs="+", type=int, default=[1],
+                        help="scale factor(s) of the input data (default: 1)")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="number of timed runs, the best one is reported (default: 3)")
+    parser.add_argument("--save", metavar="FILE", help="store the results as JSON file")
+    parser.add_argument("--compare", metavar="FILE", help="compare the results with a stored JSON file")
+    parser.add_argument("--threshold", type=float, default=1.5,
+                        help="ratio to the baseline time or peak memory increase flagged as "
+                             "regression (default: 1.5)")
+    args = parser.parse_args()
+    unknown = set(args.names) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f"unknown benchmark(s): {', '.join(sorted(unknown))}")
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+    results = {}
+    regressions = []
+    # a fresh process for each benchmark, so the peak memory is not influenced by the others
+    ctx = multiprocessing.get_context("spawn")
+    for name in args.names or BENCHMARKS:
+        for scale in args.scale:
+            key = f"{name}[x{scale}]"
+            with ctx.Pool(1) as pool:
+                result = pool.apply(run_benchmark, (name, scale, args.repeat))
+            if "skipped" in result:
+                print(f"{key:<24} skipped: {result['skipped']}")
+                continue
+            results[key] = result
+            line = (f"{key:<24} {result['time']:9.3f} s {result['throughput']:12.4g} {result['unit']}/s "
+                    f"{result['peak_rss_setup_mb']:8.0f} MB setup {result['peak_rss_increase_mb']:+8.0f} MB run")
+            if key in baseline:
+                ratio = result["time"] / baseline[key]["time"]
+                line += f"   {ratio:5.2f}x baseline"
+                flags = []
+                if ratio > args.threshold:
+                    flags.append("time")
+                base_memory = baseline[key].get("peak_rss_increase_mb")
+                if (base_memory is not None
+                        and result["peak_rss_increase_mb"] > args.threshold * base_memory
+                        and result["peak_rss_increase_mb"] - base_memory > MEMORY_TOLERANCE_MB):
+                    flags.append("memory")
+                if flags:
+                    line += f"  REGRESSION ({', '.join(flags)})"
+                    regressions.append(key)
+            print(line)
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if regressions:
+        print(f"\n{len(regressions)} benchmark(s) regressed more than {args.threshold}x the baseline: "
+              + ", ".join(regressions))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
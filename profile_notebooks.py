@@ -0,0 +1,327 @@
+"""
+Execute course notebooks headlessly and profile the time and memory of each cell.
+
+The `%load _solutions/...` cells of the notebooks in `notebooks/` are replaced
+by the content of the solution file, so the exercises are executed as well
+(and reported by the name of the solution file). For each code cell, the wall
+and CPU time, the memory (RSS) before/after and the increase of the peak RSS,
+and the largest new or changed objects in the namespace (e.g. GeoDataFrames,
+DataArrays) are recorded.
+
+Each cell is executed under cProfile, and for cells taking longer than
+`--slow` seconds the top functions are included in the report and the full
+profile is stored as a `.prof` file, which can be inspected with e.g. `snakeviz`
+(icicle/flame graph) or `python -m pstats`. To also see native (C/C++) frames of
+a slow cell, attach a sampling profiler such as `py-spy record --native` to the
+kernel. Note that cProfile adds overhead to every Python function call, which
+inflates the reported wall and CPU times (mostly of cells with many small Python
+calls). Use `--no-profile` to measure the times without cProfile, e.g. to
+compare reports.
+
+To compare two reports, the cells are matched by the solution file name or
+by (a hash of) their source code, so inserting or removing cells in a notebook
+does not mix up the comparison.
+
+Usage:
+
+    python profile_notebooks.py notebooks/13-raster-processing.ipynb
+    python profile_notebooks.py notebooks/*.ipynb --output profiles/ --no-profile
+    python profile_notebooks.py --compare profiles_old/13-raster-processing.json profiles/13-raster-processing.json
+"""
+import argparse
+import hashlib
+import json
+import re
+from pathlib import Path
+
+import nbformat
+from nbclient import NotebookClient
+
+
+LOAD_SOLUTION = re.compile(r"^# ?%load (_solutions/\S+\.py)\s*$")
+
+# Code executed in the kernel before the notebook itself, registering IPython
+# event callbacks which measure each executed cell.
+SETUP_CODE = """
+import cProfile as _prof_cProfile
+import mmap as _prof_mmap
+import numbers as _prof_numbers
+import pstats as _prof_pstats
+import sys as _prof_sys
+import time as _prof_time
+try:
+    import resource as _prof_resource
+except ImportError:  # not available on Windows
+    _prof_resource = None
+
+_prof_records = []
+_prof_state = {}
+
+
+def _prof_rss_mb():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * _prof_mmap.PAGESIZE / 1024**2
+    except OSError:
+        try:
+            import psutil
+            return psutil.Process().memory_info().rss / 1024**2
+        except ImportError:
+            return float("nan")
+
+
+def _prof_peak_mb():
+    if _prof_resource is None:
+        return float("nan")
+    peak = _prof_resource.getrusage(_prof_resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024**2 if _prof_sys.platform == "darwin" else peak / 1024
+
+
+def _prof_geometry_mb(obj):
+    \"\"\"Size in MB of the coordinates of the geometry column(s) of a GeoDataFrame/GeoSeries
+
+    pandas only counts the pointers to the (shapely) geometry objects.
+    \"\"\"
+    if type(obj).__name__ == "GeoSeries":
+        columns = [obj]
+    elif type(obj).__name__ == "GeoDataFrame":
+        columns = [obj[name] for name, dtype in obj.dtypes.items() if dtype == "geometry"]
+    else:
+        return 0
+    import shapely
+    # 2 coordinates of 8 bytes per point
+    return sum(shapely.get_num_coordinates(column.values).sum() * 16 for column in columns) / 1024**2
+
+
+def _prof_sizeof(obj):
+    \"\"\"Size in MB of (array-like) data objects, None for other objects\"\"\"
+    # classes (e.g. `np.ndarray`) also have the attributes checked below
+    if isinstance(obj, type):
+        return None
+    try:
+        if hasattr(obj, "memory_usage") and hasattr(obj, "columns"):  # (Geo)DataFrame
+            return float(obj.memory_usage(deep=True).sum()) / 1024**2 + _prof_geometry_mb(obj)
+        nbytes = getattr(obj, "nbytes", None)
+        if isinstance(nbytes, _prof_numbers.Number):  # numpy, xarray, pandas Series
+            return nbytes / 1024**2 + _prof_geometry_mb(obj)
+    except Exception:
+        pass
+    return None
+
+
+def _prof_new_objects(namespace_before):
+    \"\"\"The 5 largest data objects that are new or changed compared to `namespace_before`\"\"\"
+    user_ns = get_ipython().user_ns
+    objects = []
+    for name, obj_id in _prof_namespace().items():
+        if namespace_before.get(name) != obj_id:
+            size = _prof_sizeof(user_ns[name])
+            if size is not None:
+                objects.append({"name": name, "type": type(user_ns[name]).__name__, "size_mb": size})
+    return sorted(objects, key=lambda o: o["size_mb"], reverse=True)[:5]
+
+
+def _prof_namespace():
+    return {name: id(obj) for name, obj in get_ipython().user_ns.items() if not name.startswith("_")}
+
+
+def _prof_pre_run_cell(info):
+    _prof_state["namespace"] = _prof_namespace()
+    _prof_state["rss"] = _prof_rss_mb()
+    _prof_state["peak"] = _prof_peak_mb()
+    _prof_state["profiler"] = _prof_cProfile.Profile() if _prof_slower_than is not None else None
+    _prof_state["cpu"] = _prof_time.process_time()
+    _prof_state["wall"] = _prof_time.perf_counter()
+    if _prof_state["profiler"] is not None:
+        _prof_state["profiler"].enable()
+
+
+def _prof_post_run_cell(result):
+    if "wall" not in _prof_state:
+        return
+    if _prof_state["profiler"] is not None:
+        _prof_state["profiler"].disable()
+    wall = _prof_time.perf_counter() - _prof_state.pop("wall")
+    cpu = _prof_time.process_time() - _prof_state["cpu"]
+    record = {
+        "wall_time": wall,
+        "cpu_time": cpu,
+        "rss_before_mb": _prof_state["rss"],
+        "rss_after_mb": _prof_rss_mb(),
+        "peak_rss_increase_mb": _prof_peak_mb() - _prof_state["peak"],
+        "objects": [],
+        "error": not result.success,
+    }
+    # always add the record (IPython ignores errors in this callback), so the
+    # records stay aligned with the cells of the notebook
+    try:
+        record["objects"] = _prof_new_objects(_prof_state["namespace"])
+        if _prof_state["profiler"] is not None and wall > _prof_slower_than:
+            record["profile"] = _prof_pstats.Stats(_prof_state["profiler"])
+    finally:
+        _prof_records.append(record)
+
+
+get_ipython().events.register("pre_run_cell", _prof_pre_run_cell)
+get_ipython().events.register("post_run_cell", _prof_post_run_cell)
+"""
+
+# Code executed in the kernel after the notebook, writing the records to disk
+DUMP_CODE = """
+get_ipython().events.unregister("pre_run_cell", _prof_pre_run_cell)
+get_ipython().events.unregister("post_run_cell", _prof_post_run_cell)
+import json as _prof_json
+for _prof_i, _prof_record in enumerate(_prof_records):
+    if "profile" in _prof_record:
+        _prof_stats = _prof_record.pop("profile")
+        _prof_record["profile_file"] = f"{_prof_prefix}-{_prof_i}.prof"
+        _prof_stats.dump_stats(_prof_record["profile_file"])
+        _prof_record["top_functions"] = [
+            {"function": f"{func[0]}:{func[1]}({func[2]})", "cumulative_time": value[3], "calls": value[1]}
+            for func, value in sorted(_prof_stats.stats.items(), key=lambda item: item[1][3], reverse=True)
+            # skip the builtins and the IPython machinery around the cell code
+            if func[0] != "~" and "IPython" not in func[0]
+        ][:10]
+with open(_prof_records_file, "w") as f:
+    _prof_json.dump(_prof_records, f)
+"""
+
+
+def prepare_notebook(notebook_file):
+    """Read the notebook and replace the `%load` cells by the solution code
+
+    Returns the notebook, and a label (solution file name or cell number) and a
+    key to match cells between reports (solution file name or hash of the source)
+    for each code cell.
+    """
+    nb = nbformat.read(notebook_file, as_version=4)
+    labels, keys = [], []
+    for i, cell in enumerate(nb.cells):
+        # empty cells are not executed
+        if cell.cell_type != "code" or not cell.source.strip():
+            continue
+        match = LOAD_SOLUTION.match(cell.source.strip())
+        if match:
+            solution_file = Path(notebook_file).parent / match.group(1)
+            cell.source = solution_file.read_text(encoding="utf-8")
+            labels.append(solution_file.name)
+            keys.append(solution_file.name)
+        else:
+            labels.append(f"cell {i}")
+            key = hashlib.sha1(cell.source.strip().encode("utf-8")).hexdigest()[:12]
+            # cells with identical code are numbered in order of appearance
+            keys.append(f"{key}-{sum(k.startswith(key) for k in keys)}")
+    return nb, labels, keys
+
+
+def profile_notebook(notebook_file, output_dir, slow=1.0, timeout=600):
+    """Execute a notebook with the per-cell measurements and write the JSON report
+
+    Cells slower than `slow` seconds are profiled with cProfile, use None to disable cProfile.
+    """
+    notebook_file = Path(notebook_file).resolve()
+    output_dir = Path(output_dir).resolve()
+    output_dir.mkdir(parents=True, exist_ok=True)
+    nb, labels, keys = prepare_notebook(notebook_file)
+    sources = [cell.source for cell in nb.cells if cell.cell_type == "code" and cell.source.strip()]
+
+    records_file = output_dir / f"{notebook_file.stem}.records.json"
+    variables = (f"_prof_slower_than = {slow!r}\n"
+                 f"_prof_prefix = {str(output_dir / notebook_file.stem)!r}\n"
+                 f"_prof_records_file = {str(records_file)!r}\n")
+    nb.cells.insert(0, nbformat.v4.new_code_cell(variables + SETUP_CODE))
+    nb.cells.append(nbformat.v4.new_code_cell(DUMP_CODE))
+
+    client = NotebookClient(nb, timeout=timeout, allow_errors=True, kernel_name="python3",
+                            resources={"metadata": {"path": str(notebook_file.parent)}})
+    client.execute()
+
+    records = json.loads(records_file.read_text())
+    records_file.unlink()
+    if len(records) != len(labels):
+        raise RuntimeError(f"{notebook_file.name}: measured {len(records)} cells, but the notebook "
+                           f"has {len(labels)} code cells")
+    cells = []
+    for label, key, source, record in zip(labels, keys, sources, records):
+        if "profile_file" in record:
+            # name the profile after the cell label instead of the execution order
+            if label.endswith(".py"):
+                profile_file = output_dir / f"{Path(label).stem}.prof"
+            else:
+                profile_file = output_dir / f"{notebook_file.stem}-{label.replace(' ', '')}.prof"
+            Path(record["profile_file"]).replace(profile_file)
+            record["profile_file"] = str(profile_file)
+        record = {"cell": label, "key": key, "source": source.strip().split("\n")[0], **record}
+        cells.append(record)
+    report = {"notebook": notebook_file.name, "cells": cells}
+    report_file = output_dir / f"{notebook_file.stem}.json"
+    with open(report_file, "w") as f:
+        json.dump(report, f, indent=2)
+    return report
+
+
+def print_report(report, top=10):
+    """Print the slowest cells of a notebook report"""
+    cells = report["cells"]
+    total = sum(cell["wall_time"] for cell in cells)
+    print(f"\n{report['notebook']}: {len(cells)} code cells, {total:.1f} s")
+    print(f"{'cell':<45} {'wall (s)':>9} {'cpu (s)':>9} {'peak +MB':>9} {'rss +MB':>9}  largest new object")
+    for cell in sorted(cells, key=lambda cell: cell["wall_time"], reverse=True)[:top]:
+        largest = ""
+        if cell["objects"]:
+            obj = cell["objects"][0]
+            largest = f"{obj['name']} ({obj['type']}, {obj['size_mb']:.1f} MB)"
+        error = " [error]" if cell["error"] else ""
+        print(f"{cell['cell'] + error:<45} {cell['wall_time']:9.2f} {cell['cpu_time']:9.2f} "
+              f"{cell['peak_rss_increase_mb']:9.1f} {cell['rss_after_mb'] - cell['rss_before_mb']:9.1f}  {largest}")
+        for func in cell.get("top_functions", [])[:3]:
+            print(f"{'':<6}{func['cumulative_time']:7.2f} s  {func['function']}")
+
+
+def compare_reports(old_file, new_file, top=10):
+    """Print the cells with the largest change in wall time between two reports
+
+    Cells are matched by their key (solution file name or hash of the source), and
+    labelled by their position in the new report.
+    """
+    with open(old_file) as f:
+        old = {cell["key"]: cell for cell in json.load(f)["cells"]}
+    with open(new_file) as f:
+        new = {cell["key"]: cell for cell in json.load(f)["cells"]}
+    changes = []
+    for key in new.keys() & old.keys():
+        changes.append((new[key]["wall_time"] - old[key]["wall_time"], key))
+    print(f"{'cell':<45} {'old (s)':>9} {'new (s)':>9} {'peak +MB old':>13} {'peak +MB new':>13}")
+    for diff, key in sorted(changes, key=lambda change: abs(change[0]), reverse=True)[:top]:
+        print(f"{new[key]['cell']:<45} {old[key]['wall_time']:9.2f} {new[key]['wall_time']:9.2f} "
+              f"{old[key]['peak_rss_increase_mb']:13.1f} {new[key]['peak_rss_increase_mb']:13.1f}")
+    for key in new.keys() - old.keys():
+        print(f"{new[key]['cell']:<45} {'(new)':>9} {new[key]['wall_time']:9.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("notebooks", nargs="*", help="notebook files to profile")
+    parser.add_argument("--output", default="profiles", help="directory for the reports (default: profiles)")
+    parser.add_argument("--slow", type=float, default=1.0,
+                        help="cells slower than this (in seconds) are profiled with cProfile (default: 1)")
+    parser.add_argument("--no-profile", action="store_true",
+                        help="do not run the cells under cProfile (no overhead in the reported times)")
+    parser.add_argument("--timeout", type=int, default=600, help="timeout per cell in seconds (default: 600)")
+    parser.add_argument("--top", type=int, default=10, help="number of cells to print (default: 10)")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="compare two JSON reports")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare_reports(*args.compare, top=args.top)
+        return
+    if not args.notebooks:
+        parser.error("provide the notebook(s) to profile or --compare OLD NEW")
+    for notebook_file in args.notebooks:
+        slow = None if args.no_profile else args.slow
+        report = profile_notebook(notebook_file, args.output, slow=slow, timeout=args.timeout)
+        print_report(report, top=args.top)
+
+
+if __name__ == "__main__":
+    main()